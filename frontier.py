@@ -1,12 +1,48 @@
 import random
-import math
 import time
-import queue
+import collections
 import heapq
+import itertools
 
 import web_crawler
 
 
+class FetchTimes(dict):
+    """
+    A dictionary of (host: last-fetch-time) pairs that also keeps the running
+    sum of its values, so that the average fetch time (used as a default delay
+    for hosts never contacted before) is available in constant time.
+    """
+
+    def __init__(self):
+        """
+        Create an empty FetchTimes instance.
+        """
+        dict.__init__(self)
+        self.__total = 0
+
+    def __setitem__(self, host, fetch_time):
+        """
+        Set the last fetch time for a host, updating the running sum.
+        :param host: the hostname under discussion
+        :param fetch_time: the last fetch time, in seconds
+        """
+        self.__total += fetch_time - self.get(host, 0)
+        dict.__setitem__(self, host, fetch_time)
+
+    def delay(self, host):
+        """
+        Retrieve the last fetch time for a host, or the average across all the
+        hosts if it has never been contacted.
+        :param host: the hostname under discussion
+        :return: a float for the fetch time, in seconds
+        """
+        fetch_time = self.get(host)
+        if fetch_time is None:
+            fetch_time = self.__total / len(self) if self else 0
+        return fetch_time
+
+
 class Frontier(object):
     """
     Implementation of a frontier, the piece of a crawler
@@ -25,18 +61,21 @@ class Frontier(object):
         """
         self.__size = 0
         # Priority is assumed to be a score in [0, 1] assigned to a given url. We wish to evenly partition
-        # this domain among the front queues.
-        self.__interval = int(100 * (1 / num_front_queues))
-        # a dictionary mapping the upper bound of every interval to the corresponding Queue object
-        self.__front_queues = {(end + self.__interval) / 100: queue.Queue(maxsize=0) for end
-                               in range(0, 100, self.__interval)}
-        self.__interval /= 100  # before we needed integers for computing range()
+        # this domain among the front queues, so that the i-th deque object holds the urls whose priority
+        # falls in [i / num_front_queues, (i + 1) / num_front_queues) (the frontier is owned by a single thread,
+        # so we do not need the locking of queue.Queue)
+        self.__front_queues = [collections.deque() for _ in range(num_front_queues)]
+        self.__nonempty_fronts = 0  # how many front queues hold at least one url
 
         self.__num_back_queues = num_back_queues
-        self.__back_queues = dict()  # will become a dictionary of host: Queue pairs
+        self.__back_queues = dict()  # will become a dictionary of host: deque pairs
 
+        # the heap stores [time, counter, host] entries; the counter breaks ties between equal times and
+        # the dictionary maps every host to its live entry, so that updates do not need to scan the heap
         self.__heap = list()
         heapq.heapify(self.__heap)
+        self.__entry_finder = dict()
+        self.__counter = itertools.count()
         # define the array of probabilities to be used by the prioritizer, such that each front queue
         # in order of priority has twice the likelihood of the preceding one to be chosen
         curr_sum = 1
@@ -44,6 +83,9 @@ class Frontier(object):
         for num in range(num_front_queues):
             self.__probabilities.append(curr_sum + num)
             curr_sum += num
+        # the front queues never change after construction, so we precompute the cumulative weights once
+        # (passing them to random.choices() spares the accumulation at every call)
+        self.__cum_weights = list(itertools.accumulate(self.__probabilities))
 
     def __len__(self):
         """
@@ -58,7 +100,7 @@ class Frontier(object):
         Add an url to the frontier.
         :param url: a string for the url to add
         :param priority: a float in [0, 1] for the priority of the url
-        :param fetch_times: a dictionary of (host: last-fetch-time) pairs
+        :param fetch_times: a FetchTimes dictionary of (host: last-fetch-time) pairs
         the host for the url
         """
         # if some of the back queues have yet to be assigned a url, push the current url
@@ -67,16 +109,16 @@ class Frontier(object):
             host, _, _ = web_crawler.WebCrawler.resolve_hostname(url)
 
             if host not in self.__back_queues:
-                q = queue.Queue(maxsize=0)
+                q = collections.deque()
                 self.__back_queues[host] = q
             else:
                 q = self.__back_queues[host]
 
-            q.put(url)
+            q.append(url)
             # push into the heap a pair for the earliest time to contact again the host
             # following what suggested by the book (page 453), the new heap entry will have the current time
             # plus ten times the last fetch time (which is actually an average across all the fetch times)
-            delay = fetch_times.get(host, sum(fetch_times.values()) / len(fetch_times))
+            delay = fetch_times.delay(host)
             self.__heap_replace(time.time() + delay * 10, host)
         else:  # else, simply assign the url using the prioritizer
             self.__front_route(url, priority)
@@ -86,18 +128,23 @@ class Frontier(object):
     def dequeue(self, fetch_times):
         """
         Pop an element from the frontier and return it to the caller.
-        :param fetch_times: a dictionary of (host: last-fetch-time) pairs
+        :param fetch_times: a FetchTimes dictionary of (host: last-fetch-time) pairs
         :return: a string for the popped url
         """
         if self.__size == 0:
             raise IndexError("Heap is Empty. Troubles fetching urls?")
 
-        wait_time, host = heapq.heappop(self.__heap)
+        # pop entries until we find a live one, skipping those that have been marked as removed
+        while True:
+            wait_time, _, host = heapq.heappop(self.__heap)
+            if host is not None:
+                break
+        del self.__entry_finder[host]
         q = self.__back_queues[host]
-        result_url = q.get()
+        result_url = q.popleft()
 
         # if the queue is empty, we need to refill from the front queues in a biased manner
-        if q.empty():
+        if not q:
             host = self.__back_route(q, host)
 
         if host is not None:  # self.__back_route returns None if there are no urls left in the front queues
@@ -108,7 +155,7 @@ class Frontier(object):
                 time.sleep(max(0, wait_time - time.time()))
             # following what suggested by the book (page 453), the new heap entry will have the current time
             # plus ten times the last fetch time (which is actually an average across all the fetch times)
-            delay = fetch_times.get(host, sum(fetch_times.values()) / len(fetch_times))
+            delay = fetch_times.delay(host)
             self.__heap_replace(time.time() + delay * 10, host)
 
         self.__size -= 1
@@ -118,30 +165,34 @@ class Frontier(object):
         """
         Apply the back routing algorithm for picking an url from the front queues to be
         assigned to the back queues
-        :param q: the back Queue object
+        :param q: the back deque object
         :param our_host: the host the queue was dedicated before
         :return: the new host for the queue (can be the same as our_host)
         """
         # iterate as long as there are urls left in the front queues, unless we break because
         # we have found a new host for the queue
-        while not all([front_queue.empty() for front_queue in self.__front_queues.values()]):
+        while self.__nonempty_fronts > 0:
             # make a biased selection among the front queues according to the probabilities defined in the
             # constructor
-            selected_front = random.choices(list(self.__front_queues.values()), weights=self.__probabilities)[0]
-            candidate_url = selected_front.get()
+            selected_front = random.choices(self.__front_queues, cum_weights=self.__cum_weights)[0]
+            if not selected_front:  # an empty queue was picked, just draw again
+                continue
+            candidate_url = selected_front.popleft()
+            if not selected_front:
+                self.__nonempty_fronts -= 1
             candidate_host, _, _ = web_crawler.WebCrawler.resolve_hostname(candidate_url)
 
             # three cases: an url of the same host, an url belonging to the host of another queue, or a url of a fresh
             # new host we can use
             if candidate_host == our_host:
-                q.put(candidate_url)
+                q.append(candidate_url)
                 break
             elif candidate_host in self.__back_queues:
-                self.__back_queues[candidate_host].put(candidate_url)
+                self.__back_queues[candidate_host].append(candidate_url)
             else:
                 del self.__back_queues[our_host]
                 self.__back_queues[candidate_host] = q
-                q.put(candidate_url)
+                q.append(candidate_url)
                 our_host = candidate_host
                 break
         else:
@@ -155,22 +206,27 @@ class Frontier(object):
         :param url: a string for the url to add
         :param priority: a float in [0, 1] for the priority of the url
         """
-        prior = math.floor(priority / self.__interval)  # the index of the chosen front queue
-        front_q = list(self.__front_queues.keys())[prior]  # the key corresponding to the index
-        self.__front_queues[front_q].put(url)
+        # the index of the chosen front queue; a priority of exactly 1 belongs to the last one
+        num_front_queues = len(self.__front_queues)
+        prior = min(int(priority * num_front_queues), num_front_queues - 1)
+        front_q = self.__front_queues[prior]
+        if not front_q:
+            self.__nonempty_fronts += 1
+        front_q.append(url)
 
     def __heap_replace(self, new_time, host):
         """
         Wrapper around heapq.heappush which updates the time if host
-        is already present.
+        is already present. Instead of removing the old entry from the heap,
+        we mark it as removed (lazy deletion) and let dequeue() skip it.
         :param new_time: the time to wait before fetching again
         :param host: the hostname under discussion
         """
-        # linearly scan the heap and look for duplicates
-        for idx in range(len(self.__heap)):
-            t, h = self.__heap[idx]
-            if h == host:
-                self.__heap.pop(idx)  # eliminate the duplicate
-                break
+        # invalidate the duplicate, if any
+        old_entry = self.__entry_finder.pop(host, None)
+        if old_entry is not None:
+            old_entry[-1] = None
         # update the heap with the new time
-        heapq.heappush(self.__heap, (new_time, host))
+        entry = [new_time, next(self.__counter), host]
+        self.__entry_finder[host] = entry
+        heapq.heappush(self.__heap, entry)
@@ -1,7 +1,9 @@
 import threading
+import collections
 import requests
+from requests.adapters import HTTPAdapter
 from requests.exceptions import RequestException, Timeout
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 
 import frontier
 import web_crawler
@@ -17,7 +19,7 @@ class SingleCrawler(threading.Thread):
     """
 
     def __init__(self, name, mother, num_urls_to_crawl, seed, user_agent,
-                 num_back_queues, num_front_queues, prioritizer):
+                 num_back_queues, num_front_queues, prioritizer, batch_prioritizer=None):
         """
         Create a SingleCrawler instance
         :param name: the id of the thread in the pool, as far as we are concerned
@@ -29,26 +31,41 @@ class SingleCrawler(threading.Thread):
         :param num_front_queues: delegated to the Frontier constructor
         :param prioritizer: a function that, given a webpage, assigns a priority score
         in [0, 1]
+        :param batch_prioritizer: an optional function that, given a list of urls, returns
+        a sequence (e.g. a numpy array) of their priority scores in [0, 1]. If provided,
+        it is used in place of prioritizer, with one call per crawled page
         """
         threading.Thread.__init__(self)
         self.setName(name)
         self.__num_urls_to_crawl = num_urls_to_crawl
         self.__mother = mother
-        self.__fetch_times = dict()  # a dictionary of (host: last-fetch-time) pairs
+        self.__fetch_times = frontier.FetchTimes()  # a dictionary of (host: last-fetch-time) pairs
         self.__fetch_times[web_crawler.WebCrawler.resolve_hostname(seed)[0]] = 0  # we assume no delay for the seed
         self.__frontier = frontier.Frontier(num_back_queues, num_front_queues)
         self.__frontier.enqueue(seed, 1, self.__fetch_times)
+        # the frontier is touched by this thread only: other threads push (url, priority) pairs into this inbox,
+        # and the owner drains it into the frontier at every iteration
+        self.__inbox = collections.deque()
+        self.__inbox_lock = threading.Lock()
         self.__user_agent = user_agent
+        # a thread-local session, so that connections (and their TCP/TLS handshakes) are reused across
+        # requests to the same host. The user-agent is set once for all the requests
+        self.__session = requests.Session()
+        self.__session.headers.update({"user-agent": user_agent})
+        adapter = HTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=0)
+        self.__session.mount("http://", adapter)
+        self.__session.mount("https://", adapter)
         self.__prioritizer = prioritizer
+        self.__batch_prioritizer = batch_prioritizer
         self.__count = 0
 
     def get_length_frontier(self):
         """
         Retrieve number of urls sitting in the frontier. Needed from outside to
         compute statistics.
-        :return: the length of the frontier
+        :return: the length of the frontier (including the urls waiting in the inbox)
         """
-        return len(self.__frontier)
+        return len(self.__frontier) + len(self.__inbox)
 
     def get_count_urls_crawled(self):
         """
@@ -71,14 +88,16 @@ class SingleCrawler(threading.Thread):
         """
         # iterate as long as we do not reach the target number of pages to crawl
         while self.__count < self.__num_urls_to_crawl:
+            # move the urls received from the team into the frontier
+            self.__drain_inbox()
             # dequeue an url from the frontier
             curr_url = self.__frontier.dequeue(self.__fetch_times)
             # print(curr_url)
             # before proceeding, make sure the url is allowed from the robots.txt. As suggested
             # by the book (page 447), the robots.txt should be checked just before fetching, because
             # on large-scale crawls a url might reside on the frontier for days; in the meanwhile, the
-            # file might have changed. Of course, here it makes sense to trade performance for conservatism
-            rules = web_crawler.WebCrawler.be_fair(curr_url, self.__user_agent)
+            # file might have changed. Since it rarely does within a day, the mother caches it for that long
+            rules = self.__mother.be_fair(curr_url, self.__user_agent)
             if not rules["allowed"]:
                 continue
 
@@ -87,24 +106,34 @@ class SingleCrawler(threading.Thread):
             if response is None:
                 continue
             self.__count += 1
-            # update the last fetch time for the host
-            self.__fetch_times[web_crawler.WebCrawler.resolve_hostname(curr_url)[0]] = response.elapsed.total_seconds()
             # parse the webpage for robust urls and assign them a priority score
             parsed_urls = self.__parse_urls(response)
-            priorities = [self.__prioritizer(url) for url in parsed_urls]  # beware it should not be the url
-            # recall the delay specified in the robots.txt, if any. Otherwise, we follow again the suggestion
-            # of the book (page 453), we define the last fetch time times ten as desired delay
-            self.__fetch_times[web_crawler.WebCrawler.resolve_hostname(curr_url)[0]] = rules["delay"] if rules["delay"]\
-                else response.elapsed.total_seconds()
+            priorities = self.__prioritize(parsed_urls)
+            # update the last fetch time for the host: recall the delay specified in the robots.txt, if any.
+            # Otherwise, we follow again the suggestion of the book (page 453), we define the last fetch time
+            # times ten as desired delay
+            host = web_crawler.WebCrawler.resolve_hostname(curr_url)[0]
+            self.__fetch_times[host] = rules["delay"] if rules["delay"] else response.elapsed.total_seconds()
 
             # SYNCHRONIZED PART
-            with threading.Lock():  # acquire a lock
+            with self.__mother.get_sync_lock():  # acquire the lock shared by the team
                 # sift out duplicates and update the url table
-                parsed_urls = self.__mother.check_and_update_urls(parsed_urls)
+                parsed_urls, priorities = self.__mother.check_and_update_urls(parsed_urls, priorities)
                 # ask the mother to assign the urls to the appropriate thread
                 self.__mother.synchronize_frontiers(parsed_urls, self.getName(), priorities)
-                # update the global array of webpage responses
-                self.__mother.retrieve(response)
+            # update the global queue of webpage responses
+            self.__mother.retrieve(response)
+
+    def __prioritize(self, urls):
+        """
+        Assign a priority score to every url of a batch, in a single call if a
+        batch prioritizer was provided.
+        :param urls: a list for the urls under discussion
+        :return: a sequence for the priority scores of the urls, in the same order
+        """
+        if self.__batch_prioritizer is not None:
+            return self.__batch_prioritizer(urls)
+        return [self.__prioritizer(url) for url in urls]  # beware it should not be the url
 
     def __fetch(self, url, time_quantum=1.0, num_attempt=0):
         """
@@ -119,7 +148,7 @@ class SingleCrawler(threading.Thread):
         :return: a requests.models.Response object, None for failure
         """
         try:
-            response = requests.get(url, headers={"user-agent": self.__user_agent}, timeout=time_quantum)
+            response = self.__session.get(url, timeout=time_quantum, allow_redirects=True)
         except Timeout:  # retry for a maximum of 4 times, each time trice the time quantum
             if num_attempt >= 4:
                 return None
@@ -135,49 +164,63 @@ class SingleCrawler(threading.Thread):
 
     def __parse_urls(self, response):
         """
-        Extract all the urls contained in a page using BeautifulSoup, and return the
-        robust ones.
+        Extract all the urls contained in a page using BeautifulSoup (backed by the lxml
+        parser), and return the robust ones.
         :param response: a requests.models.Response object
         :return: a list for the valid urls
         """
         source_url = response.url
-        soup = BeautifulSoup(response.text, "html.parser")
-        # as a matter of example: "en.wikipedia.org" is strip_base, "https://en.wikipedia.org" is base_url,
-        # "https://en.wikipedia.org/wiki/Main_Page" is path
-        strip_base, base_url, path = web_crawler.WebCrawler.resolve_hostname(source_url)
+        # lxml is a C parser, much faster than html.parser; feeding it the raw bytes lets it detect the
+        # encoding by itself, and the strainer makes it build only the anchor tags with an href attribute
+        soup = BeautifulSoup(response.content, "lxml", parse_only=SoupStrainer("a", href=True))
+        # as a matter of example: "https://en.wikipedia.org" is base_url, "https://en.wikipedia.org/wiki/Main_Page"
+        # is path. They only depend on the source url, so they are computed once for all the anchors
+        _, base_url, path = web_crawler.WebCrawler.resolve_hostname(source_url)
+        be_robust = web_crawler.WebCrawler.be_robust
         parsed_urls = set()
 
         # iterate over all the HTML anchor tags
         for link in soup.find_all("a"):
-            # check if they have an href attribute
-            anchor = link.get("href")
-            if anchor is None:
-                continue
+            anchor = link["href"]
 
-            # deal with different formatting styles for href urls
-            curr_url = anchor
+            # deal with different formatting styles for href urls: root-relative, absolute
+            # and page-relative ones. Prefix checks are enough, no need for substring search
             if anchor.startswith('/'):
                 curr_url = base_url + anchor
-            elif strip_base in anchor:
+            elif anchor.startswith('http'):
                 curr_url = anchor
-            elif not anchor.startswith('http'):
+            else:
                 curr_url = path + anchor
 
             # test the url for robustness
-            curr_url, status = web_crawler.WebCrawler.be_robust(curr_url)
+            curr_url, status = be_robust(curr_url)
             if status:
                 parsed_urls.add(curr_url)
             # else:
             #     print("here is a faulty one: " + curr_url)
         return list(parsed_urls)
 
+    def __drain_inbox(self):
+        """
+        Enqueue into the frontier all the urls that have been added to the inbox.
+        The inbox is swapped with an empty one, so that the lock is held only for
+        the swap and not while enqueuing.
+        """
+        with self.__inbox_lock:
+            batch, self.__inbox = self.__inbox, collections.deque()
+        for url, priority in batch:
+            self.__frontier.enqueue(url, priority, self.__fetch_times)
+
     def frontier_add(self, url, priority):
         """
-        Interface for adding a url to the frontier owned by the thread.
+        Interface for adding a url to the frontier owned by the thread. Since
+        it can be called by any thread, the url is only put in the inbox; the
+        owner will move it into the frontier.
         :param url: a string for the url to enqueue
         :param priority: its priority score, in [0, 1]
         """
-        self.__frontier.enqueue(url, priority, self.__fetch_times)
+        with self.__inbox_lock:
+            self.__inbox.append((url, priority))
 
     def frontier_remove(self):
         """
@@ -3,6 +3,8 @@ import random
 import time
 import threading
 import logging
+import queue
+import functools
 from requests.exceptions import RequestException
 from urllib.parse import urlparse, urlunparse, urlsplit
 from reppy.robots import Robots
@@ -11,6 +13,20 @@ from reppy.exceptions import ReppyException
 import single_crawler
 
 
+# the robustness heuristics of WebCrawler.be_robust, compiled once and merged into a single alternation
+# so that a url is tested with one call. The cheap patterns come first, the backtracking one last
+_TRAP_PATTERN = re.compile(
+    # urls that have the word 'calendar' in them, sometimes related to a fatal crawler trap
+    r"^.*calendar.*$|"
+    # urls that have hundreds of subdirectories
+    r"^.*/[^/]{300,}$|"
+    # urls that have some common directories repeating more than three times
+    r"^.*(?:/misc|/sites|/all|/themes|/modules|/profiles|/css|/field|/node|/theme){3,}.*$|"
+    # urls that have the same directory repeating different times
+    r"^.*?(?P<dir>/.+?/).*?(?P=dir).*$|^.*?/(?P<subdir>.+?/)(?P=subdir).*$"
+)
+
+
 class WebCrawler(object):
     """
     Implementation of a web crawler. In particular, this
@@ -19,10 +35,12 @@ class WebCrawler(object):
     by a distinct class (SingleCrawler), WebCrawler is responsible
     for storing global or shared data (like the table for unique urls,
     ...), as well as incapsulating functionalities that require some
-    synchronization among threads, or that are static in nature (like
-    checking if a url is fair/robust).
+    synchronization among threads (like checking if a url is fair), or
+    that are static in nature (like checking if a url is robust).
     """
 
+    ROBOTS_TTL = 86400  # seconds a fetched robots.txt is considered valid (one day)
+
     def __init__(self):
         """
         Create an instance of a web crawler.
@@ -30,12 +48,26 @@ class WebCrawler(object):
         self.__urls = set()  # a hashtable for the uniques urls found
         self.__host_to_thread = dict()  # a dicionary of (host, thread) pairs
         self.__threads = list()  # to store the Thread objects
-        self.__output = list()  # to store the output pages for the user
+        self.__name_to_thread = dict()  # a dictionary of (name, thread) pairs, for direct access
+        self.__robots_cache = dict()  # a dictionary of (robots-url, (Robots, expiry-time)) pairs
+        self.__sync_lock = threading.RLock()  # shared among threads to guard the data above
+        self.__output = queue.Queue()  # to store the output pages for the user (thread-safe on its own)
+
+    def get_sync_lock(self):
+        """
+        Retrieve the lock shared by all the threads, to be acquired before
+        touching the url table, the host-thread table and the robots.txt cache.
+        :return: a threading.RLock object
+        """
+        return self.__sync_lock
 
     @staticmethod
+    @functools.lru_cache(maxsize=100000)
     def resolve_hostname(url):
         """
         Static method that, given a url, retrieves some of its building blocks.
+        Since it is called several times for the same url along the pipeline, and
+        it is deterministic, the results are memoized.
         :param url: a string for the url under discussion
         :return: a tuple with the bare domain, the protocol + domain, and the full path
         """
@@ -49,22 +81,28 @@ class WebCrawler(object):
         path = url[:url.rfind('/') + 1] if '/' in parts.path else url
         return strip_base, base_url, path
 
-    @staticmethod
-    def be_fair(url, user_agent):
+    def be_fair(self, url, user_agent):
         """
-        Static method to test whether a url satisfies the robots.txt for its
-        hostname. It also returns the delay specified for the user-agent, if any.
+        Test whether a url satisfies the robots.txt for its hostname. It also
+        returns the delay specified for the user-agent, if any. Parsed robots.txt
+        files are cached (and shared among threads) for ROBOTS_TTL seconds.
         :param url: a string for the url under discussion
         :param user_agent: the user agent performing the request
         :return: a dictionary with a boolean value for "allowed" key and a timedelta
         value for "delay" key
         """
-        # retrieve the url of the robots.txt, try to fetch it
+        # retrieve the url of the robots.txt, and look for a fresh copy in the cache
         robots_url = Robots.robots_url(url)
-        try:
-            robots = Robots.fetch(robots_url, headers={"user-agent": user_agent})
-        except (ReppyException, RequestException):
-            return {"allowed": False, "delay": None}
+        with self.__sync_lock:
+            robots, expiry = self.__robots_cache.get(robots_url, (None, 0))
+        # if not there, try to fetch it. The network call is done outside the lock, as it is the slow part
+        if time.time() >= expiry:
+            try:
+                robots = Robots.fetch(robots_url, headers={"user-agent": user_agent})
+            except (ReppyException, RequestException):
+                return {"allowed": False, "delay": None}
+            with self.__sync_lock:
+                self.__robots_cache[robots_url] = (robots, time.time() + self.ROBOTS_TTL)
         return {"allowed": robots.allowed(url, user_agent), "delay": robots.agent(user_agent).delay}
 
     @staticmethod
@@ -85,31 +123,27 @@ class WebCrawler(object):
         # urls that are too long, since they are probably tricky (2048 is the value used by Googlebot)
         if len(url) > 2048:
             return url, False
-        # urls that have hundreds of subdirectories
-        elif re.search(r"^.*/[^/]{300,}$", url) is not None:
-            return url, False
-        # urls that have the same directory repeating different times
-        elif re.search(r"^.*?(/.+?/).*?\1.*$|^.*?/(.+?/)\2.*$", url) is not None:
-            return url, False
-        # urls that have some common directories repeating more than three times
-        elif re.search(r"^.*(/misc|/sites|/all|/themes|/modules|/profiles|/css|"
-                       r"/field|/node|/theme){3,}.*$", url) is not None:
-            return url, False
-        # urls that have the word 'calendar' in them, sometimes related to a fatal crawler trap
-        elif re.search(r"^.*calendar.*$", url) is not None:
+        # urls that fall into any of the other traps (see _TRAP_PATTERN)
+        elif _TRAP_PATTERN.search(url) is not None:
             return url, False
         return url, True
 
-    def check_and_update_urls(self, urls):
+    def check_and_update_urls(self, urls, priorities):
         """
         Filter duplicates from a list of urls, using a table common to all
-        threads.
+        threads. Priorities are filtered alongside, so that they stay aligned
+        with the surviving urls.
         :param urls: a list for the urls under discussion
-        :return: the parsed list
+        :param priorities: a list for the priority scores of the urls
+        :return: a pair with the parsed list of urls and the list of their priorities
         """
-        result = list(filter(lambda x: x not in self.__urls, urls))
-        self.__urls.update(urls)
-        return result
+        # a dictionary of (url, priority) pairs also takes care of in-list duplicates
+        scores = dict(zip(urls, priorities))
+        # set difference and union run in bulk, without a Python-level callback per url
+        new_urls = scores.keys() - self.__urls
+        self.__urls |= new_urls
+        new_urls = list(new_urls)
+        return new_urls, [scores[url] for url in new_urls]
 
     def synchronize_frontiers(self, urls, sender, priorities):
         """
@@ -133,17 +167,15 @@ class WebCrawler(object):
                 owner = sender
 
             # retrieve the Thread object and delegate enqueuing to its frontier
-            for thread in threading.enumerate():
-                if thread.getName() == owner:
-                    thread.frontier_add(url, priorities[num])
+            self.__name_to_thread[owner].frontier_add(url, priorities[num])
 
     def retrieve(self, out_page):
         """
-        Append a response to the output list, ready to be delivered to the
+        Put a response in the output queue, ready to be delivered to the
         user.
         :param out_page: a requests.models.Response object
         """
-        self.__output.append(out_page)
+        self.__output.put(out_page)
 
     def log_info(self):
         """
@@ -152,20 +184,25 @@ class WebCrawler(object):
         size and number of hosts contacted. Supposed to be run by the main
         thread in a typical workflow.
         """
-        frontier_size = sum([thread.get_length_frontier() for thread in self.__threads])
-        num_urls = sum([thread.get_count_urls_crawled for thread in self.__threads])
-        num_hosts = sum([thread.get_num_hosts_contacted() for thread in self.__threads])
-        logging.info("\nn° active non-main threads: " + str(threading.active_count() - 1) +
+        # collect all the statistics in a single pass over the team
+        frontier_size = num_urls = num_hosts = 0
+        for thread in self.__threads:
+            frontier_size += thread.get_length_frontier()
+            num_urls += thread.get_count_urls_crawled()
+            num_hosts += thread.get_num_hosts_contacted()
+        num_active = threading.active_count() - 1
+        logging.info("\nn° active non-main threads: " + str(num_active) +
                      "\nn° unique urls crawled: " + str(num_urls) +
                      "\naggregate frontier size: " + str(frontier_size) +
                      "\nn° hosts contacted: " + str(num_hosts) + "\n")
 
-    def crawl(self, num_urls, seeds, user_agent, num_threads, prioritizer=lambda x: random.random(), verbose=1):
+    def crawl(self, num_urls, seeds, user_agent, num_threads, prioritizer=lambda x: random.random(), verbose=1,
+              batch_prioritizer=None):
         """
         Run the overall crawling pipeline. In particular, different threads are instantiated
         and instructed to progress the crawling. In the meanwhile, the main thread (that is
-        sitting idle) "listens" for changes to self.__output (where fetched pages are dumped
-        by individual threads) and yields them to the user. This function is supposed to
+        sitting idle) blocks on self.__output (where fetched pages are dumped by individual
+        threads) and yields them to the user. This function is supposed to
         be used as a generator.
         :param num_urls: total number of urls to crawl
         :param seeds: the entry points for the threads, a dictionary of (num_thread, list-of-assigned-seeds) pairs
@@ -173,6 +210,8 @@ class WebCrawler(object):
         :param prioritizer: a function that, given a url, assigns a priority score in [0, 1]
         :param num_threads: number of threads to spawn
         :param verbose: whether to log information every 30 seconds
+        :param batch_prioritizer: an optional function that, given a list of urls, returns a sequence (e.g. a
+        numpy array) of priority scores in [0, 1]; if provided, it takes the place of prioritizer
         :return: generates requests.models.Response objects for the fetched pages
         """
         # perform some checks on user-provided input
@@ -191,21 +230,23 @@ class WebCrawler(object):
         # FORK THE TEAM
         for name in range(num_threads):
             self.__threads.append(single_crawler.SingleCrawler(str(name), self, num_urls_per_thread, seeds[name],
-                                                               user_agent, 3, 5, prioritizer))
+                                                               user_agent, 3, 5, prioritizer,
+                                                               batch_prioritizer))
+            self.__name_to_thread[str(name)] = self.__threads[-1]
             self.__threads[-1].start()
 
         # this block is executed by the main thread. Notice this is a VERY rough implementation
         # of the Observer Pattern
         if threading.current_thread().getName() == "MainThread":
-            current_pos = 0
             prec_time = time.time()
-            # loop until there are no active threads working in the team
-            while threading.active_count() > 1:
-                # check for any change in the array storing the output pages. If a new one
-                # has been appended, yield it to the user
-                if len(self.__output) > current_pos:
-                    yield self.__output[-1]
-                    current_pos += 1
+            # loop until there are no active threads working in the team, and no pages left to deliver
+            while threading.active_count() > 1 or not self.__output.empty():
+                # wait for a new page in the output queue and yield it to the user. The timeout
+                # lets us periodically check whether the team is still alive
+                try:
+                    yield self.__output.get(timeout=1)
+                except queue.Empty:
+                    pass
                 # if required, log useful info every 30 seconds
                 if verbose and time.time() >= prec_time + 30:
                     self.log_info()